@@ -1,29 +1,175 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import bottleneck as bn
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import date
+from typing import NamedTuple
+from functools import lru_cache
 import os
+import html
+import pickle
+import tempfile
 import csv
 
 # Page configuration
 st.set_page_config(page_title="Price History Viewer", layout="wide")
 
+# Сколько предметов рисуется отдельными трейсами; больше - одним общим
+MAX_SEPARATE_TRACES = 10
+# Сколько точек одного ряда отправляется в браузер
+MAX_PLOT_POINTS = 2000
+# Во сколько раз ряд должен быть длиннее MAX_PLOT_POINTS, чтобы его прореживать
+LTTB_MIN_FACTOR = 4
+# Сколько предметов в списке выбора, пока не включен полный список
+MAX_ITEM_OPTIONS = 50
+
+# CSS для контроля размера изображения
+IMAGE_STYLE = """
+    <style>
+    .item-image {
+        margin-top: -10px;
+        max-width: 350px;  /* фиксированная максимальная ширина */
+        width: 100%;
+        height: auto;
+        margin-left: auto;
+        margin-right: auto;
+        display: block;
+        object-fit: contain;
+    }
+    </style>
+"""
+
+# Display metrics with responsive font size and theme-aware colors
+METRIC_STYLE = """
+    <style>
+    .metric-container {
+        text-align: center;
+        padding: 0.5rem;
+    }
+    .metric-label {
+        font-size: 0.8rem;
+        color: var(--text-color-secondary);
+        margin-bottom: 0.3rem;
+        white-space: nowrap;
+        overflow: hidden;
+        text-overflow: ellipsis;
+    }
+    .metric-value {
+        font-size: 1rem;
+        font-weight: bold;
+        color: var(--text-color-primary);
+        white-space: nowrap;
+        overflow: hidden;
+        text-overflow: ellipsis;
+    }
+
+    /* Адаптивные стили для разных размеров экрана */
+    @media (min-width: 1200px) {
+        .metric-label { font-size: 1rem; }
+        .metric-value { font-size: 1.2rem; }
+    }
+
+    @media (max-width: 768px) {
+        .metric-label { font-size: 0.7rem; }
+        .metric-value { font-size: 0.9rem; }
+    }
+
+    @media (max-width: 480px) {
+        .metric-label { font-size: 0.6rem; }
+        .metric-value { font-size: 0.8rem; }
+    }
+
+    /* Light theme colors */
+    [data-theme="light"] {
+        --text-color-primary: #0f0f0f;
+        --text-color-secondary: #888;
+    }
+
+    /* Dark theme colors */
+    [data-theme="dark"] {
+        --text-color-primary: #ffffff;
+        --text-color-secondary: #cccccc;
+    }
+    </style>
+"""
+
+# Theme detection script
+THEME_SCRIPT = """
+    <script>
+        if (document.documentElement.classList.contains('dark')) {
+            document.documentElement.setAttribute('data-theme', 'dark');
+        } else {
+            document.documentElement.setAttribute('data-theme', 'light');
+        }
+    </script>
+"""
+
+# Каноническое имя предмета для поиска картинки: без кавычек, лишних пробелов и регистра.
+# Набор имен конечен (столбцы истории цен), поэтому результат запоминается
+@lru_cache(maxsize=4096)
+def normalize_name(name):
+    return ' '.join(name.replace('"', '').split()).casefold()
+
+# Записывает файл во временный рядом и подменяет им старый одной операцией:
+# прерванная запись не оставляет обрезанного файла
+def replace_file(path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# Размер и mtime CSV: по ним решается, актуальна ли сохраненная из него копия
+def csv_state(stat):
+    return f"{stat.st_size}:{stat.st_mtime_ns}".encode()
+
+# Словарь {каноническое имя: url картинки} из img.csv
+def read_image_csv(csv_path):
+    table = pv.read_csv(
+        csv_path,
+        convert_options=pv.ConvertOptions(
+            include_columns=['name', 'img'],
+            column_types={'name': pa.string(), 'img': pa.string()},
+        ),
+    ).drop_null()
+    # Один канонический ключ на строку; поиск в main нормализует имя так же
+    names = table.column('name').to_pylist()
+    return {normalize_name(name): url for name, url in zip(names, table.column('img').to_pylist())}
+
+# Готовый словарь хранится рядом с CSV в pickle вместе с размером и mtime CSV,
+# из которого он построен, и пересобирается, только если CSV с тех пор изменился.
+# Нечитаемый pickle - такой же промах, как отсутствующий
+def ensure_image_pickle(csv_path):
+    pickle_path = os.path.splitext(csv_path)[0] + ".pkl"
+    state = csv_state(os.stat(csv_path))
+    try:
+        with open(pickle_path, 'rb') as file:
+            cached_state, img_dict = pickle.load(file)
+        if cached_state == state:
+            return img_dict
+    except Exception:
+        pass
+
+    img_dict = read_image_csv(csv_path)
+    # Не удалось сохранить pickle - словарь все равно уже построен
+    try:
+        replace_file(pickle_path, lambda file: pickle.dump((state, img_dict), file, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        pass
+    return img_dict
+
 # Image data loading function
 @st.cache_data
 def load_image_data():
     try:
-        with open("data/img.csv", 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-        
-        img_dict = {}
-        for line in lines[1:]:  # skip header
-            split_index = line.find("https://")
-            if split_index != -1:
-                name = line[:split_index].strip()
-                img = line[split_index:].strip()
-                img_dict[name] = img
-                
-        return img_dict
+        return ensure_image_pickle("data/img.csv")
         
     except FileNotFoundError:
         st.error("File img.csv not found.")
@@ -32,45 +178,343 @@ def load_image_data():
         st.error(f"Error reading img.csv file: {str(e)}")
         return {}
 
-@st.cache_data(ttl=60)
+# Ключ метаданных Parquet: байт CSV, до которого строки уже сконвертированы
+CSV_OFFSET_KEY = b'csv_offset'
+# Ключ метаданных Parquet: размер и mtime CSV, который был прочитан для этой копии
+CSV_STATE_KEY = b'csv_state'
+
+# Имена столбцов из строки заголовка CSV
+def read_csv_header(file):
+    return next(csv.reader([file.readline().decode('utf-8')]), [])
+
+# Типы столбцов задаются заранее, чтобы Arrow не угадывал их по данным:
+# timestamp - время, все цены - float32 (вдвое меньше памяти, чем float64)
+def price_schema(names):
+    return pa.schema([
+        (name, pa.timestamp('ns') if name == 'timestamp' else pa.float32())
+        for name in names
+    ])
+
+# Разбирает строки CSV без заголовка; end - позиция в файле, где кончаются data.
+# csv_offset сохраняется, только если data кончается полной строкой, иначе 0:
+# тогда следующее изменение файла перечитает его целиком
+def parse_price_csv(data, schema, end):
+    # Arrow парсит CSV в несколько потоков и сразу приводит timestamp к datetime
+    table = pv.read_csv(
+        pa.BufferReader(data),
+        read_options=pv.ReadOptions(column_names=schema.names),
+        convert_options=pv.ConvertOptions(
+            column_types=dict(zip(schema.names, schema.types)),
+            timestamp_parsers=['%Y-%m-%d %H:%M:%S'],
+        ),
+    )
+    offset = end if data.endswith(b'\n') else 0
+    return table.replace_schema_metadata({CSV_OFFSET_KEY: str(offset)})
+
+# Читает CSV целиком, включая последнюю строку без перевода строки.
+# Если она не разбирается (файл дописывается прямо сейчас), берутся только полные строки
+def read_price_csv(file):
+    schema = price_schema(read_csv_header(file))
+    start = file.tell()
+    data = file.read()
+    try:
+        return parse_price_csv(data, schema, start + len(data))
+    except pa.ArrowInvalid:
+        if data.endswith(b'\n'):
+            raise
+        data = data[:data.rfind(b'\n') + 1]
+        return parse_price_csv(data, schema, start + len(data))
+
+# Дописывает к сохраненной таблице строки, добавленные в CSV после прошлой конвертации;
+# если полных новых строк нет, возвращает ту же таблицу.
+# Возвращает None, если файл был переписан (другой заголовок, стал короче и т.п.)
+# или сохраненная копия записана с другими типами столбцов
+def append_csv_tail(file, cached):
+    offset = int((cached.schema.metadata or {}).get(CSV_OFFSET_KEY, 0))
+    if offset <= 0 or offset > os.fstat(file.fileno()).st_size:
+        return None
+
+    schema = price_schema(read_csv_header(file))
+    file.seek(offset - 1)
+    if not cached.schema.equals(schema) or file.read(1) != b'\n':
+        return None
+
+    # Недописанная последняя строка дочитается в следующий раз
+    data = file.read()
+    data = data[:data.rfind(b'\n') + 1]
+    if not data:
+        return cached
+    try:
+        tail = parse_price_csv(data, cached.schema, offset + len(data))
+    except pa.ArrowInvalid:
+        return None
+    return pa.concat_tables([cached, tail]).replace_schema_metadata(tail.schema.metadata)
+
+# Сохраненная копия или None, если ее нет или она не читается (поврежденная копия -
+# такой же промах, как отсутствующая: CSV просто парсится заново)
+def read_parquet_copy(parquet_path):
+    try:
+        return pq.read_table(parquet_path, memory_map=True)
+    except (OSError, pa.ArrowException):
+        return None
+
+# Таблица цен из Parquet-копии CSV. Копия пересобирается, только если CSV изменился
+# с тех пор, как ее записали; если CSV только дописывался, парсятся лишь новые строки
+def load_price_table(csv_path):
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+    cached = read_parquet_copy(parquet_path)
+
+    with open(csv_path, 'rb') as file:
+        # Состояние снимается до чтения: если CSV допишут во время разбора, оно
+        # не совпадет с текущим, и новые строки дочитаются при следующей загрузке
+        state = csv_state(os.fstat(file.fileno()))
+        if cached is not None and (cached.schema.metadata or {}).get(CSV_STATE_KEY) == state:
+            return cached
+
+        table = None
+        if cached is not None:
+            table = append_csv_tail(file, cached)
+        if table is None:
+            file.seek(0)
+            table = read_price_csv(file)
+    # Новых полных строк нет - копия не меняется
+    if table is cached:
+        return cached
+    table = table.replace_schema_metadata({**table.schema.metadata, CSV_STATE_KEY: state})
+
+    # Не удалось сохранить копию - не беда, таблица уже в памяти
+    try:
+        replace_file(parquet_path, lambda file: pq.write_table(table, file, compression='zstd'))
+    except OSError:
+        pass
+    return table
+
+# История цен и все, что из нее вычисляется один раз при загрузке
+class PriceData(NamedTuple):
+    last_modified: float
+    ts_ns: np.ndarray
+    prices: np.ndarray
+    col_index: dict
+    items: tuple
+    t_min: date
+    t_max: date
+
+PRICE_HISTORY_PATH = "data/price_history.csv"
+
+# Данные пересобираются только при изменении файла: ключ кэша - его mtime
 def load_data():
-    file_path = "data/price_history.csv"
-    last_modified = os.path.getmtime(file_path)
-    df = pd.read_csv(file_path)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    return df, last_modified
+    return _load_data_at(os.path.getmtime(PRICE_HISTORY_PATH))
+
+# Один общий объект на версию файла, без копирования; массивы только для чтения
+@st.cache_resource(max_entries=1)
+def _load_data_at(last_modified):
+    # DataFrame не строится: графику и статистике нужны только срезы столбцов по строкам
+    table = load_price_table(PRICE_HISTORY_PATH).sort_by('timestamp')
+    # int64-представление времени для бинарного поиска по периоду
+    ts_ns = table.column('timestamp').to_numpy().view('i8')
+    # Цены всех предметов одной float32-матрицей (строки - время, столбцы - предметы);
+    # порядок по столбцам, чтобы срез одного предмета был непрерывным
+    names = [name for name in table.column_names if name != 'timestamp']
+    prices = np.empty((table.num_rows, len(names)), dtype=np.float32, order='F')
+    for i, name in enumerate(names):
+        # Пропуски (null) становятся NaN
+        prices[:, i] = table.column(name).to_numpy()
+    prices.flags.writeable = False
+    ts_ns.flags.writeable = False
+    col_index = {name: i for i, name in enumerate(names)}
+    items = tuple(col_index)
+    # Данные отсортированы, поэтому границы периода - первая и последняя строки
+    t_min = pd.Timestamp(ts_ns[0]).date()
+    t_max = pd.Timestamp(ts_ns[-1]).date()
+    return PriceData(last_modified, ts_ns, prices, col_index, items, t_min, t_max)
 
 @st.cache_data
 def load_supply_data():
     supply_path = "data/nft_supply_results.csv"
     try:
-        supply_df = pd.read_csv(supply_path)
+        supply_df = pd.read_csv(supply_path, engine='pyarrow', dtype_backend='pyarrow')
         supply_dict = dict(zip(supply_df['Item Name'], supply_df['Estimated Supply']))
         return supply_dict
     except FileNotFoundError:
         st.error(f"File {supply_path} not found.")
         return {}
     
-# Функция для получения последнего непустого значения
-def get_last_valid_price(df, item):
-    # Получаем все непустые значения
-    valid_prices = df[item].dropna()
-    if len(valid_prices) > 0:
-        return valid_prices.iloc[-1]
-    return None
-
-def calculate_price_change(df, item):
-    valid_prices = df[item].dropna()
-    if len(valid_prices) >= 2:
-        start_price = valid_prices.iloc[0]
-        end_price = valid_prices.iloc[-1]
+# Первая и последняя непустые цены, минимум и максимум за один отбор NaN.
+# Здесь и ниже _data не хэшируется: версию данных в ключе кэша задает last_modified
+@st.cache_data(max_entries=512)
+def get_price_stats(_data, item, lo, hi, last_modified):
+    prices = _data.prices[lo:hi, _data.col_index[item]]
+    prices = prices[~np.isnan(prices)]
+    if not len(prices):
+        return None, None, None, None
+    return prices[0], prices[-1], prices.min(), prices.max()
+
+# Изменение цены (%) между первой и последней непустыми ценами каждого предмета.
+# Считается сразу по всей матрице и только при обновлении файла (ключ - его mtime)
+@st.cache_data(max_entries=4)
+def get_price_changes(_data, last_modified):
+    prices = _data.prices
+    valid = ~np.isnan(prices)
+    cols = np.arange(prices.shape[1])
+    start_price = prices[valid.argmax(axis=0), cols]
+    end_price = prices[len(prices) - 1 - valid[::-1].argmax(axis=0), cols]
+    with np.errstate(divide='ignore', invalid='ignore'):
         percent_change = ((end_price - start_price) / start_price) * 100
-        return percent_change
-    return 0
+    # Меньше двух цен - изменения нет
+    percent_change = np.where(valid.sum(axis=0) >= 2, percent_change, 0)
+    return dict(zip(_data.items, percent_change.tolist()))
+
+# Подписи "Item (Supply: N)" для всех предметов - общие для списка выбора и легенды графика
+@st.cache_data(max_entries=4)
+def get_supply_labels(_data, last_modified):
+    supply_dict = load_supply_data()
+    return {item: f"{item} (Supply: {int(supply_dict.get(item, 0))})" for item in _data.items}
+
+# Подписи для списка выбора, отсортированные по изменению цены (по убыванию),
+# и словарь для преобразования отображаемых имен обратно в оригинальные.
+# Строятся один раз на версию файла с ценами, а не на каждое действие в интерфейсе
+@st.cache_data(max_entries=4)
+def build_labels(_data, last_modified):
+    changes = get_price_changes(_data, last_modified)
+    supply_labels = get_supply_labels(_data, last_modified)
+    items_with_changes = []
+    for item, change in changes.items():
+        arrow = "↑" if change >= 0 else "↓"
+        display_name = f"{arrow} {abs(change):.1f}% | {supply_labels[item]}"
+        items_with_changes.append((display_name, change, item))
+    
+    items_with_changes.sort(key=lambda x: x[1], reverse=True)
+    display_to_original = {item[0]: item[2] for item in items_with_changes}
+    # Короткий список по умолчанию: предметы с наибольшим |изменением|, в том же порядке
+    top = {item[2] for item in sorted(items_with_changes, key=lambda x: abs(x[1]), reverse=True)[:MAX_ITEM_OPTIONS]}
+    top_options = [item[0] for item in items_with_changes if item[2] in top]
+    return items_with_changes, display_to_original, top_options
+
+# Скользящее среднее по строкам (для матрицы - по каждому столбцу сразу);
+# окно длиннее ряда дает только NaN, как у pandas rolling
+def moving_average(values, window):
+    if window > len(values):
+        return np.full(values.shape, np.nan, dtype=values.dtype)
+    return bn.move_mean(values, window=window, min_count=window, axis=0)
+
+# Largest-Triangle-Three-Buckets: индексы не более n_out точек, сохраняющих форму ряда,
+# плюс первая NaN-точка каждого разрыва. Короткие ряды отдаются целиком
+def lttb_indices(x, y, n_out=MAX_PLOT_POINTS):
+    if len(y) <= LTTB_MIN_FACTOR * n_out:
+        return np.arange(len(y))
+    missing = np.isnan(y)
+    gaps = np.flatnonzero(missing & ~np.concatenate(([False], missing[:-1])))
+    valid = np.flatnonzero(~missing)
+    n = len(valid)
+    if n <= n_out:
+        return np.union1d(valid, gaps)
+
+    vx = x[valid].astype(np.float64)
+    vy = y[valid].astype(np.float64)
+    # Первая и последняя точки сохраняются, остальные делятся на n_out - 2 корзины;
+    # средние точки всех корзин считаются заранее
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(np.append(edges, n))
+    avg_x = np.add.reduceat(vx, edges) / counts
+    avg_y = np.add.reduceat(vy, edges) / counts
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        dx, dy = vx[a] - avg_x[i + 1], avg_y[i + 1] - vy[a]
+        # Удвоенная площадь треугольника с точками a и средней следующей корзины
+        area = np.abs(dx * (vy[start:end] - vy[a]) - (vx[a] - vx[start:end]) * dy)
+        a = start + int(area.argmax())
+        picked[i + 1] = a
+    return np.union1d(valid[picked], gaps)
+
+# Индексы прореженных точек одного предмета за период (кэш - по предмету, без окна MA)
+@st.cache_data(max_entries=2048)
+def get_plot_indices(_data, item, lo, hi, last_modified):
+    return lttb_indices(_data.ts_ns[lo:hi], _data.prices[lo:hi, _data.col_index[item]])
+
+# Прореженные до разрешения графика ряды предметов за период: x, цены и скользящие
+# средние (окно None - без MA). MA считается одним проходом по всей матрице
+# выбранных столбцов и берется в тех же точках, что и цены
+@st.cache_data(max_entries=512)
+def compute_series(_data, items, lo, hi, window, last_modified):
+    y_all = _data.prices[lo:hi, [_data.col_index[item] for item in items]]
+    ma_all = moving_average(y_all, window) if window else None
+
+    # Время уходит в браузер числом миллисекунд (float64): Plotly передает такие массивы
+    # base64-буфером, а не списком строк дат; ось x объявлена как date
+    ts = _data.ts_ns[lo:hi] / 1e6
+    xs, ys, mas = [], [], []
+    for k, item in enumerate(items):
+        idx = get_plot_indices(_data, item, lo, hi, last_modified)
+        xs.append(ts[idx])
+        ys.append(y_all[idx, k])
+        mas.append(ma_all[idx, k] if window else None)
+    return xs, ys, mas
+
+# Один трейс для нескольких рядов: ряды идут подряд, разделенные точкой с NaN,
+# имя предмета для подсказки передается через customdata
+def combined_trace(xs, ys, names, **kwargs):
+    seps = [x[-1:] for x in xs]
+    return go.Scattergl(
+        x=np.concatenate([part for x, sep in zip(xs, seps) for part in (x, sep)]),
+        y=np.concatenate([part for y, sep in zip(ys, seps) for part in (y, np.full(len(sep), np.nan, y.dtype))]),
+        mode='lines',
+        customdata=np.repeat(names, [len(x) + len(sep) for x, sep in zip(xs, seps)]),
+        hovertemplate="%{customdata}: %{y:.2f}<extra></extra>",
+        **kwargs
+    )
+
+# Трейсы графика цен: пары (цена, MA) для каждого предмета либо, при большом выборе,
+# одна такая пара на все предметы. ma_period=None - без скользящего среднего
+def build_traces(data, items, lo, hi, ma_period, supply_labels):
+    window = int(ma_period * 2) if ma_period else None
+    xs, ys, mas = compute_series(data, tuple(items), int(lo), int(hi), window, data.last_modified)
+
+    traces = []
+    if len(items) > MAX_SEPARATE_TRACES:
+        # Много предметов - рисуем все одним трейсом, иначе Plotly сильно тормозит
+        traces.append(combined_trace(xs, ys, items, name="Price"))
+        if window:
+            traces.append(combined_trace(
+                xs, mas, items,
+                line=dict(dash='dash'),
+                name=f"MA({ma_period}h)"
+            ))
+    else:
+        for item, x, y, ma in zip(items, xs, ys, mas):
+            traces.append(go.Scattergl(
+                x=x,
+                y=y,
+                mode='lines',
+                name=supply_labels[item]
+            ))
+            
+            if window:
+                traces.append(go.Scattergl(
+                    x=x,
+                    y=ma,
+                    mode='lines',
+                    line=dict(dash='dash'),
+                    name=f'{item} MA({ma_period}h)'
+                ))
+    return traces
+
+# Границы строк [lo, hi) для выбранного периода, включая весь последний день
+def get_date_slice(ts_ns, date_range):
+    start = np.datetime64(date_range[0], 'ns').view('i8')
+    end = (np.datetime64(date_range[1], 'ns') + np.timedelta64(1, 'D')).view('i8')
+    lo = np.searchsorted(ts_ns, start, side='left')
+    hi = np.searchsorted(ts_ns, end, side='left')
+    return lo, hi
 
 def main():
+    # Стили и скрипт темы выводятся одним элементом в начале страницы
+    st.markdown(IMAGE_STYLE + METRIC_STYLE + THEME_SCRIPT, unsafe_allow_html=True)
+
     # Load all data
-    df, _ = load_data()
+    data = load_data()
     supply_dict = load_supply_data()
     img_dict = load_image_data()
     default_img = "https://i.ibb.co/tpZ9HsSY/photo-2023-12-23-09-42-33.jpg"
@@ -98,51 +542,53 @@ def main():
         1. Select items of interest in the sidebar
         2. Set your desired time period
         3. Optionally enable moving averages for better trend analysis
+        4. Press Apply to update the chart
 
         This tool is completely free and open source. Feel free to provide feedback and suggestions for improvement!
 
         ---
         """)
 
-    # Проверка соответствия имен
-    items = [col for col in df.columns if col != 'timestamp']
-    
-    # Вычисляем изменение цены для каждого предмета
-    items_with_changes = []
-    for item in items:
-        change = calculate_price_change(df, item)
-        arrow = "↑" if change >= 0 else "↓"
-        display_name = f"{arrow} {abs(change):.1f}% | {item} (Supply: {int(supply_dict.get(item, 0))})"
-        items_with_changes.append((display_name, change, item))
-    
-    # Сортируем по изменению цены (по убыванию)
-    items_with_changes.sort(key=lambda x: x[1], reverse=True)
+    # Подписи с изменением цены для каждого предмета (кэшируются по mtime файла)
+    items_with_changes, display_to_original, top_options = build_labels(data, data.last_modified)
     
-    # Создаем словарь для преобразования отображаемых имен обратно в оригинальные
-    display_to_original = {item[0]: item[2] for item in items_with_changes}
-    
-    # Sidebar with filters
-    with st.sidebar:
-        st.header("Filters")
-        
+    # Sidebar with filters. Виджеты собраны в форму: пока значения меняются
+    # (перетаскивание слайдера, выбор первой даты), страница не перезапускается -
+    # график строится по последним примененным значениям
+    st.sidebar.header("Filters")
+    # Длинный список вариантов тормозит multiselect при каждом нажатии клавиши,
+    # поэтому по умолчанию показываются только самые изменившиеся предметы
+    show_all_items = st.sidebar.checkbox(
+        f"Show all items (default: top {MAX_ITEM_OPTIONS} by price change)", value=False
+    )
+    # Уже выбранные предметы (и предмет по умолчанию) остаются в списке всегда,
+    # иначе переключение флажка сбрасывало бы выбор
+    default_options = [item[0] for item in items_with_changes[:1]]
+    shown = set(top_options) | set(default_options) | set(st.session_state.get("selected_items", ()))
+    item_options = [item[0] for item in items_with_changes if show_all_items or item[0] in shown]
+
+    with st.sidebar.form("filters"):
         selected_items_with_changes = st.multiselect(
-            f"Select items (total: {len(items)})",
-            [item[0] for item in items_with_changes],
-            default=[items_with_changes[0][0]] if items_with_changes else []
+            f"Select items (total: {len(data.items)})",
+            item_options,
+            default=default_options,
+            key="selected_items"
         )
         
         selected_items = [display_to_original[item] for item in selected_items_with_changes]
         
         date_range = st.date_input(
             "Select period",
-            value=(df['timestamp'].min().date(), df['timestamp'].max().date()),
-            min_value=df['timestamp'].min().date(),
-            max_value=df['timestamp'].max().date()
+            value=(data.t_min, data.t_max),
+            min_value=data.t_min,
+            max_value=data.t_max
         )
         
+        # Слайдер показывается всегда: внутри формы флажок применяется только по кнопке
         show_ma = st.checkbox("Show moving average", value=True)
-        if show_ma:
-            ma_period = st.slider("Moving average period (hours)", 1, 24, 6)
+        ma_period = st.slider("Moving average period (hours)", 1, 24, 6)
+
+        st.form_submit_button("Apply")
 
         # Создаем колонки для заголовка и процента
     title_col, percent_col = st.columns([2, 1])
@@ -156,18 +602,20 @@ def main():
         st.error("Please select two dates to define the period")
         return
 
+    # Период выбирается один раз - для процента, графика и статистики
+    lo, hi = get_date_slice(data.ts_ns, date_range)
+
     # Display chart and statistics
     if selected_items:
-        mask = (df['timestamp'].dt.date >= date_range[0]) & (df['timestamp'].dt.date <= date_range[1])
-        filtered_df = df.loc[mask]
-        
-        # Теперь добавляем процентное изменение в правую колонку
-        with percent_col:
-            if len(selected_items) == 1:
-                item = selected_items[0]
-                start_price = filtered_df[item].dropna().iloc[0] if not filtered_df[item].dropna().empty else None
-                end_price = get_last_valid_price(filtered_df, item)
-                
+        if len(selected_items) == 1:
+            # Цены одного предмета считаются один раз для процента и статистики
+            item = selected_items[0]
+            start_price, end_price, min_price, max_price = get_price_stats(
+                data, item, lo, hi, data.last_modified
+            )
+            
+            # Теперь добавляем процентное изменение в правую колонку
+            with percent_col:
                 if start_price is not None and end_price is not None:
                     percent_change = ((end_price - start_price) / start_price) * 100
                     color = "green" if percent_change >= 0 else "red"
@@ -181,183 +629,61 @@ def main():
                         """, 
                         unsafe_allow_html=True
                     )
-
-    # Check date_range
-    if len(date_range) != 2:
-        st.error("Please select two dates to define the period")
-        return
-
-    # Display chart and statistics
-    if selected_items:
-        mask = (df['timestamp'].dt.date >= date_range[0]) & (df['timestamp'].dt.date <= date_range[1])
-        filtered_df = df.loc[mask]
         
-        fig = go.Figure()
+        # График переиспользуется между перезапусками: при тех же предметах и периоде
+        # он не строится заново, а при смене периода MA обновляются только линии MA
+        ma_hours = ma_period if show_ma else None
+        fig_key = (tuple(selected_items), int(lo), int(hi), data.last_modified)
+        cached_fig = st.session_state.get('price_fig')
+        supply_labels = get_supply_labels(data, data.last_modified)
         
-        for item in selected_items:
-            fig.add_trace(go.Scatter(
-                x=filtered_df['timestamp'],
-                y=filtered_df[item],
-                mode='lines',
-                name=f"{item} (Supply: {int(supply_dict.get(item, 0))})"
-            ))
-            
-            if show_ma:
-                window = int(ma_period * 2)
-                ma = filtered_df[item].rolling(window=window).mean()
-                fig.add_trace(go.Scatter(
-                    x=filtered_df['timestamp'],
-                    y=ma,
-                    mode='lines',
-                    line=dict(dash='dash'),
-                    name=f'{item} MA({ma_period}h)'
-                ))
-        
-        fig.update_layout(
-            height=600,
-            xaxis_title="Time",
-            yaxis_title="Price",
-            hovermode='x unified',
-            legend=dict(
-                yanchor="top",
-                y=0.99,
-                xanchor="left",
-                x=0.01
+        if cached_fig is None or cached_fig[0] != fig_key or (cached_fig[1] is None) != (ma_hours is None):
+            fig = go.Figure(build_traces(data, selected_items, lo, hi, ma_hours, supply_labels))
+            fig.update_layout(
+                height=600,
+                xaxis_title="Time",
+                xaxis_type="date",
+                yaxis_title="Price",
+                hovermode='x unified',
+                legend=dict(
+                    yanchor="top",
+                    y=0.99,
+                    xanchor="left",
+                    x=0.01
+                )
             )
-        )
+        else:
+            fig = cached_fig[2]
+            if cached_fig[1] != ma_hours:
+                # Трейсы MA идут вторыми в каждой паре (цена, MA)
+                traces = build_traces(data, selected_items, lo, hi, ma_hours, supply_labels)
+                for old_trace, new_trace in zip(fig.data[1::2], traces[1::2]):
+                    old_trace.y = new_trace.y
+                    old_trace.name = new_trace.name
+        
+        st.session_state['price_fig'] = (fig_key, ma_hours, fig)
         
         st.plotly_chart(fig, use_container_width=True)
         
         if len(selected_items) == 1:
-            item = selected_items[0]
-            
-            # Calculate percentage change
-            start_price = filtered_df[item].dropna().iloc[0] if not filtered_df[item].dropna().empty else None
-            end_price = get_last_valid_price(filtered_df, item)
-
             img_col, stats_col = st.columns([0.5, 2])
             
             with img_col:
-                # CSS для контроля размера изображения
-                st.markdown("""
-                    <style>
-                    [data-testid="stImage"] {
-                        margin-top: -10px;
-                        max-width: 350px !important;  /* фиксированная максимальная ширина */
-                        width: 100% !important;
-                        margin-left: auto !important;
-                        margin-right: auto !important;
-                        display: block !important;
-                    }
-                    [data-testid="stImage"] > img {
-                        max-width: 400px !important;  /* контроль размера самого изображения */
-                        width: 100% !important;
-                        object-fit: contain !important;
-                    }
-                    </style>
-                    """, unsafe_allow_html=True)
-
-                # Нормализация имени и создание вариантов
-                item_clean = ' '.join(item.split())
-                item_variants = [
-                    item,
-                    item_clean,
-                    item_clean.lower(),
-                    item.strip('"'),
-                    item.strip().strip('"'),
-                    item.lower().strip(),
-                ]
-
-                # Поиск изображения по всем вариантам
-                img_url = None
-                for variant in item_variants:
-                    if variant in img_dict:
-                        img_url = img_dict[variant]
-                        break
-
-                if img_url is None:
-                    img_url = default_img
-
-                # Отображаем изображение
-                st.image(img_url, use_container_width=True)
+                img_url = img_dict.get(normalize_name(item), default_img)
+
+                # Отображаем изображение обычным <img>: браузер кэширует его сам,
+                # без прокси /media, а фиксированная ширина не дает сдвигать разметку
+                st.markdown(
+                    f'<img class="item-image" src="{html.escape(img_url)}" width="400" loading="lazy">',
+                    unsafe_allow_html=True
+                )
                 
             with stats_col:
                 st.subheader(f"Statistics - {item}")
                 col1, col2, col3, col4, col5 = st.columns(5)
                 
-                current_price = get_last_valid_price(filtered_df, item)
-                min_price = filtered_df[item].dropna().min() if not filtered_df[item].dropna().empty else None
-                max_price = filtered_df[item].dropna().max() if not filtered_df[item].dropna().empty else None
                 supply = supply_dict.get(item, 0)
                 
-                # Display metrics with responsive font size and theme-aware colors
-                metric_style = """
-                    <style>
-                    .metric-container {
-                        text-align: center;
-                        padding: 0.5rem;
-                    }
-                    .metric-label {
-                        font-size: 0.8rem;
-                        color: var(--text-color-secondary);
-                        margin-bottom: 0.3rem;
-                        white-space: nowrap;
-                        overflow: hidden;
-                        text-overflow: ellipsis;
-                    }
-                    .metric-value {
-                        font-size: 1rem;
-                        font-weight: bold;
-                        color: var(--text-color-primary);
-                        white-space: nowrap;
-                        overflow: hidden;
-                        text-overflow: ellipsis;
-                    }
-
-                    /* Адаптивные стили для разных размеров экрана */
-                    @media (min-width: 1200px) {
-                        .metric-label { font-size: 1rem; }
-                        .metric-value { font-size: 1.2rem; }
-                    }
-
-                    @media (max-width: 768px) {
-                        .metric-label { font-size: 0.7rem; }
-                        .metric-value { font-size: 0.9rem; }
-                    }
-
-                    @media (max-width: 480px) {
-                        .metric-label { font-size: 0.6rem; }
-                        .metric-value { font-size: 0.8rem; }
-                    }
-
-                    /* Light theme colors */
-                    [data-theme="light"] {
-                        --text-color-primary: #0f0f0f;
-                        --text-color-secondary: #888;
-                    }
-
-                    /* Dark theme colors */
-                    [data-theme="dark"] {
-                        --text-color-primary: #ffffff;
-                        --text-color-secondary: #cccccc;
-                    }
-                    </style>
-                """
-
-                st.markdown(metric_style, unsafe_allow_html=True)
-
-                # Add theme detection script
-                theme_script = """
-                    <script>
-                        if (document.documentElement.classList.contains('dark')) {
-                            document.documentElement.setAttribute('data-theme', 'dark');
-                        } else {
-                            document.documentElement.setAttribute('data-theme', 'light');
-                        }
-                    </script>
-                """
-                st.markdown(theme_script, unsafe_allow_html=True)
-
                 # Custom metric display function remains the same
                 def custom_metric(label, value):
                     return f"""
@@ -374,7 +700,7 @@ def main():
                     return f"{value:.2f}"
 
 
-                col1.markdown(custom_metric("Current Price", format_value(current_price)), unsafe_allow_html=True)
+                col1.markdown(custom_metric("Current Price", format_value(end_price)), unsafe_allow_html=True)
                 col2.markdown(custom_metric("Minimum Price", format_value(min_price)), unsafe_allow_html=True)
                 col3.markdown(custom_metric("Maximum Price", format_value(max_price)), unsafe_allow_html=True)
                 col4.markdown(custom_metric("Supply", f"{int(supply)}"), unsafe_allow_html=True)